@@ -1,9 +1,15 @@
+import hashlib
+import json
 import math
+import queue
 import random
+import re
+import stat
 import sys
 import threading
 import time
 from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
 from pathlib import Path
 
 import pygame
@@ -18,11 +24,34 @@ class Config:
     transition_duration: float = 0.8
     caption_font_size: int = 64
     background_blur_radius: int = 30
+    cache_dir: Path = field(  # Pre-rendered slide layers are stored here
+        default_factory=lambda: Path("~/.cache/simple-slideshow").expanduser()
+    )
+    cache_max_age_days: float = 30  # Cache entries unused for this long are deleted
     supported_ext: frozenset = field(
         default_factory=lambda: frozenset({".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"})
     )
 
 
+# Bump whenever slide rendering changes so stale cache entries are ignored
+CACHE_VERSION = 7
+
+# Files written by save_cached_layers: {sha1}.json / {sha1}.{fg,bg}.raw, plus
+# the {name}.{thread id}.tmp files they are written through
+CACHE_FILE_RE = re.compile(r"^([0-9a-f]{40})\.(?:json|(?:fg|bg)\.raw)(?:\.\d+\.tmp)?$")
+
+# Number of upcoming slides kept loaded ahead of the one being shown
+PRELOAD_AHEAD = 2
+
+# Caption fonts, tried in order
+FONT_CANDIDATES = (
+    str(Path(__file__).resolve().parent / "fonts" / "IBMPlexSans-Bold.ttf"),
+    "IBMPlexSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/System/Library/Fonts/Helvetica.ttc",
+)
+
+
 def scan_photos(config: Config) -> list[Path]:
     """Return a sorted list of Paths for supported images."""
     directory = config.photos_dir
@@ -43,50 +72,68 @@ def caption_from_path(path: Path) -> str:
 
 
 def pil_to_surface(img: Image.Image) -> pygame.Surface:
-    """Convert a PIL RGBA image to a pygame Surface."""
-    raw = img.tobytes("raw", "RGBA")
-    return pygame.image.fromstring(raw, img.size, "RGBA")
+    """Convert a PIL RGB or RGBA image to a pygame Surface backed by its pixel bytes."""
+    # frombuffer references the bytes instead of copying them like fromstring
+    return pygame.image.frombuffer(img.tobytes("raw", img.mode), img.size, img.mode)
+
 
+def blit_sequence(target: pygame.Surface, blit_seq: list) -> None:
+    """Blit (surface, dest) pairs onto target in a single call."""
+    if hasattr(target, "fblits"):
+        target.fblits(blit_seq)
+    else:  # fblits() is not available in older pygame
+        target.blits(blit_seq, doreturn=False)
 
-def fit_image(img: Image.Image, target_w: int, target_h: int) -> Image.Image:
-    """Scale PIL image to fit target dimensions, preserving aspect ratio."""
-    img_w, img_h = img.size
+
+def fit_size(img_w: int, img_h: int, target_w: int, target_h: int) -> tuple[int, int]:
+    """Return the size that fits target dimensions, preserving aspect ratio."""
     scale = min(target_w / img_w, target_h / img_h)
-    new_w = int(img_w * scale)
-    new_h = int(img_h * scale)
-    return img.resize((new_w, new_h), Image.LANCZOS)
+    return int(img_w * scale), int(img_h * scale)
 
 
 def build_background(
     img: Image.Image, screen_w: int, screen_h: int, blur_radius: int
 ) -> Image.Image:
-    """Create a blurred, darkened version of img stretched to screen size."""
-    bg = img.convert("RGB").resize((screen_w, screen_h), Image.LANCZOS)
-    bg = bg.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-    overlay = Image.new("RGB", (screen_w, screen_h), (0, 0, 0))
-    bg = Image.blend(bg, overlay, alpha=0.45)
-    return bg.convert("RGBA")
+    """Create a blurred, darkened version of img at quarter screen resolution.
+
+    The result has no fine detail, so it is kept small (which also keeps the
+    disk cache small) and stretched to screen size when the slide is composed.
+    """
+    # The blur radius shrinks with the image
+    scale = 4
+    small_size = (max(1, screen_w // scale), max(1, screen_h // scale))
+    bg = img if img.mode == "RGB" else img.convert("RGB")
+    bg = bg.resize(small_size, Image.BILINEAR)
+    # Pillow implements GaussianBlur as three running-sum box blur passes, so
+    # its cost is already independent of blur_radius
+    bg = bg.filter(ImageFilter.GaussianBlur(radius=blur_radius / scale))
+    # Darken by 45%: blending with black is a constant scale, so use a LUT
+    lut = [int(i * 0.55) for i in range(256)]
+    return bg.point(lut * 3)
+
+
+@lru_cache(maxsize=8)
+def load_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    """Return the first available caption font at size, loaded once per size."""
+    for candidate in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
 
 
+@lru_cache(maxsize=16)
 def build_caption_surface(text: str, screen_w: int, font_size: int) -> pygame.Surface:
-    """Render caption as a full-width frosted bar flush to the bottom."""
+    """Render caption as a full-width frosted bar flush to the bottom.
+
+    Results are memoized, so slides with the same caption share one Surface.
+    Each bar is a full-width RGBA surface (~750 KB at 1080p), so the cache is
+    kept small.
+    """
     pad_y = 18
 
-    font_candidates = [
-        str(Path(__file__).parent / "fonts" / "IBMPlexSans-Bold.ttf"),
-        "IBMPlexSans-Bold.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-        "/System/Library/Fonts/Helvetica.ttc",
-    ]
-    pil_font = None
-    for candidate in font_candidates:
-        try:
-            pil_font = ImageFont.truetype(candidate, font_size)
-            break
-        except OSError:
-            continue
-    if pil_font is None:
-        pil_font = ImageFont.load_default()
+    pil_font = load_font(font_size)
 
     dummy = Image.new("RGBA", (1, 1))
     bbox = ImageDraw.Draw(dummy).textbbox((0, 0), text, font=pil_font)
@@ -105,37 +152,181 @@ def build_caption_surface(text: str, screen_w: int, font_size: int) -> pygame.Su
     draw.text((text_x + 1, text_y + 1), text, font=pil_font, fill=(0, 0, 0, 90))  # shadow
     draw.text((text_x, text_y), text, font=pil_font, fill=(255, 255, 255, 245))
 
-    return pil_to_surface(bar)
+    return pil_to_surface(bar).convert_alpha()
 
 
-class Slide:
-    def __init__(self, path: Path, screen_w: int, screen_h: int, config: Config):
-        self.path = path
-        self.caption = caption_from_path(path)
+def slide_cache_key(path: Path, screen_w: int, screen_h: int, config: Config) -> str:
+    """Return a key identifying the rendered layers of a slide."""
+    parts = (
+        CACHE_VERSION,
+        str(path.resolve()),
+        path.stat().st_mtime_ns,
+        screen_w,
+        screen_h,
+        config.background_blur_radius,
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
 
-        pil_img = Image.open(path).convert("RGBA")
 
-        # Background layer
-        bg_pil = build_background(pil_img, screen_w, screen_h, config.background_blur_radius)
-        self.background = pil_to_surface(bg_pil)
+def surface_format(surf: pygame.Surface) -> str:
+    """Return the raw pixel format ("RGB" or "RGBA") that preserves surf."""
+    return "RGBA" if surf.get_flags() & pygame.SRCALPHA else "RGB"
 
-        # Foreground (fitted) layer
-        fg_pil = fit_image(pil_img, screen_w, screen_h)
-        self.foreground = pil_to_surface(fg_pil)
-        self.fg_rect = self.foreground.get_rect(center=(screen_w // 2, screen_h // 2))
 
-        # Caption — only rendered when the filename starts with '$'
-        if path.name.startswith("$"):
-            self.caption_surf = build_caption_surface(
-                self.caption, screen_w, config.caption_font_size
+def load_cached_layers(cache_dir: Path, key: str) -> dict[str, pygame.Surface] | None:
+    """Load pre-rendered layers for key, or return None on a cache miss."""
+    sidecar = cache_dir / f"{key}.json"
+    try:
+        meta = json.loads(sidecar.read_text())
+        layers = {
+            name: pygame.image.frombuffer(
+                (cache_dir / f"{key}.{name}.raw").read_bytes(), (w, h), fmt
             )
-            cap_rect = self.caption_surf.get_rect()
-            self.cap_x = (screen_w - cap_rect.width) // 2
-            self.cap_y = screen_h - cap_rect.height - 40
-        else:
-            self.caption_surf = None
-            self.cap_x = 0
-            self.cap_y = 0
+            for name, (w, h, fmt) in meta.items()
+        }
+    except (OSError, ValueError, TypeError):
+        return None
+    try:
+        sidecar.touch()  # mark as recently used so prune_cache keeps it
+    except OSError:
+        pass
+    return layers
+
+
+def save_cached_layers(cache_dir: Path, key: str, layers: dict[str, pygame.Surface]) -> None:
+    """Store layers as raw pixel dumps plus a JSON sidecar holding size and format."""
+
+    def _write(target: Path, data: bytes):
+        # Per-thread temporary name so concurrent writers never share a file
+        tmp = target.with_name(f"{target.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(target)
+
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        meta = {}
+        for name, surf in layers.items():
+            fmt = surface_format(surf)
+            _write(cache_dir / f"{key}.{name}.raw", pygame.image.tobytes(surf, fmt))
+            meta[name] = (*surf.get_size(), fmt)
+        # Sidecar goes last: its presence marks the entry as complete
+        _write(cache_dir / f"{key}.json", json.dumps(meta).encode())
+    except OSError as exc:
+        print(f"[WARN] Could not write slide cache: {exc}")
+
+
+def prune_cache(cache_dir: Path, max_age_days: float) -> None:
+    """Delete cache entries whose files have not been touched in max_age_days.
+
+    Entries orphaned by a changed mtime, screen size or CACHE_VERSION are
+    never hit again, so they age out here along with leftover .tmp files.
+    Only regular files matching CACHE_FILE_RE are considered; anything else
+    in cache_dir is left alone.
+    """
+    cutoff = time.time() - max_age_days * 86400
+    entries: dict[str, list[tuple[Path, float]]] = {}
+    try:
+        candidates = list(cache_dir.iterdir())
+    except OSError:
+        return  # no cache yet
+    for f in candidates:
+        match = CACHE_FILE_RE.match(f.name)
+        if match is None:
+            continue
+        try:
+            st = f.lstat()
+        except OSError:
+            continue  # vanished mid-scan
+        if stat.S_ISREG(st.st_mode):
+            entries.setdefault(match.group(1), []).append((f, st.st_mtime))
+
+    for files in entries.values():
+        if max(mtime for _, mtime in files) >= cutoff:
+            continue
+        for f, _ in files:
+            try:
+                f.unlink(missing_ok=True)
+            except OSError as exc:
+                print(f"[WARN] Could not prune slide cache file: {exc}")
+
+
+def render_layers(
+    path: Path, screen_w: int, screen_h: int, config: Config
+) -> dict[str, pygame.Surface]:
+    """Render the foreground and, where needed, background layers for path."""
+    pil_img = Image.open(path)
+    if pil_img.format == "JPEG":
+        # Let libjpeg decode at a reduced DCT scale; there's no need for
+        # full camera resolution when the result is fitted to the screen
+        pil_img.draft("RGB", (screen_w * 2, screen_h * 2))
+    # Only images with transparency need the extra alpha channel
+    pil_img = pil_img.convert("RGBA" if pil_img.has_transparency_data else "RGB")
+
+    # Foreground (fitted) layer — scaled by pygame straight from PIL's buffer
+    fg_w, fg_h = fit_size(*pil_img.size, screen_w, screen_h)
+    fg = pil_to_surface(pil_img)
+    layers = {"fg": pygame.transform.smoothscale(fg, (fg_w, fg_h))}
+
+    # Background layer — skipped when the foreground covers the whole screen
+    if fg_w < screen_w - 2 or fg_h < screen_h - 2:
+        bg_pil = build_background(pil_img, screen_w, screen_h, config.background_blur_radius)
+        layers["bg"] = pil_to_surface(bg_pil)
+    return layers
+
+
+class Slide:
+    def __init__(self, path: Path, screen_w: int, screen_h: int, config: Config):
+        self.path = path
+        self.caption = caption_from_path(path)
+        self._screen_size = (screen_w, screen_h)
+        self._screen_w = screen_w
+        self._font_size = config.caption_font_size
+
+        key = slide_cache_key(path, screen_w, screen_h, config)
+        layers = load_cached_layers(config.cache_dir, key)
+        if layers is None:
+            layers = render_layers(path, screen_w, screen_h, config)
+            save_cached_layers(config.cache_dir, key, layers)
+
+        foreground = layers["fg"]
+        self.fg_rect = foreground.get_rect(center=(screen_w // 2, screen_h // 2))
+
+        # Layers in draw order, flattened later by composed. Full-bleed images
+        # have no background layer and keep the composed surface's black fill.
+        self._blit_seq = []
+        if "bg" in layers:
+            background = pygame.transform.smoothscale(layers["bg"], (screen_w, screen_h))
+            self._blit_seq.append((background, (0, 0)))
+        self._blit_seq.append((foreground, self.fg_rect))
+        self._scaled: pygame.Surface | None = None
+
+    @cached_property
+    def composed(self) -> pygame.Surface:
+        """Layers flattened into an opaque surface in the display's pixel format.
+
+        Built on first draw so a crossfade frame is just two full-screen blits.
+        convert() reads the display surface, which set_mode() may be replacing,
+        so this must run on the main thread rather than the preload worker.
+        """
+        surf = pygame.Surface(self._screen_size).convert()
+        blit_sequence(surf, self._blit_seq)
+        self._blit_seq = []  # the layers are no longer needed
+        return surf
+
+    @cached_property
+    def caption_surf(self) -> pygame.Surface | None:
+        """Caption bar, built on first draw; only filenames starting with '$' have one."""
+        if not self.path.name.startswith("$"):
+            return None
+        return build_caption_surface(self.caption, self._screen_w, self._font_size)
+
+    def frame(self, size: tuple[int, int]) -> pygame.Surface:
+        """Return the composed slide at size, scaling it for windowed mode."""
+        if size == self.composed.get_size():
+            return self.composed
+        if self._scaled is None or self._scaled.get_size() != size:
+            self._scaled = pygame.transform.smoothscale(self.composed, size)
+        return self._scaled
 
 
 class Slideshow:
@@ -163,23 +354,38 @@ class Slideshow:
         # State
         self.paused = False
         self.running = True
+        self._dirty = True  # screen needs redrawing outside of a transition
 
         # Transition state
         self.transitioning = False
         self.transition_start = 0.0
         self.current_slide: Slide | None = None
         self.next_slide: Slide | None = None
+        self._pending_idx = 0  # index of next_slide
         self.alpha = 255  # alpha of current slide (255 = fully visible)
+        # Ease in-out (sine) alpha of the current slide, one entry per 60 fps frame
+        frames = max(1, round(self.config.transition_duration * 60))
+        self._alpha_table = [
+            int(255 * (1 + math.cos(math.pi * i / frames)) / 2) for i in range(frames + 1)
+        ]
 
         # Slide timer
         self.slide_start = time.time()
 
+        prune_cache(self.config.cache_dir, self.config.cache_max_age_days)
+
+        # Preloaded slides; set up before any load since a failed one clears them
+        self._preload_q: queue.Queue[int] = queue.Queue()
+        self._slides: dict[int, Slide] = {}
+        self._slides_cond = threading.Condition()  # guards _slides and _loading
+        self._loading: int | None = None  # index the worker is loading right now
+        self._preload_center = self.index
+
         # Load first slide
         self.current_slide = self._load_slide(self.index)
-        # Pre-load next in background
-        self._preload_thread: threading.Thread | None = None
-        self._preloaded: Slide | None = None
-        self._start_preload(self._next_index())
+        # Pre-load upcoming slides on a persistent worker thread
+        threading.Thread(target=self._preload_worker, daemon=True).start()
+        self._request_preload(self.index)
 
     def _next_index(self, step: int = 1) -> int:
         return (self.index + step) % len(self.paths)
@@ -193,26 +399,59 @@ class Slideshow:
             return Slide(path, self.screen_w, self.screen_h, self.config)
         except OSError:
             print(f"[WARN] Could not load image, skipping: {path}")
-            self.paths.pop(idx)
+            with self._slides_cond:
+                self.paths.pop(idx)
+                # Indices past idx have shifted down; the worker can get here
+                # mid-transition, so keep the shown and pending slides in place
+                self._slides.clear()
+                if self.index > idx:
+                    self.index -= 1
+                if self._pending_idx > idx:
+                    self._pending_idx -= 1
+                if self._preload_center > idx:
+                    self._preload_center -= 1
             return None
 
-    def _start_preload(self, idx: int):
-        def _load():
-            if idx < len(self.paths):
-                self._preloaded = self._load_slide(idx)
-
-        self._preload_thread = threading.Thread(target=_load, daemon=True)
-        self._preload_thread.start()
-
-    def _get_preloaded(self, expected_idx: int) -> Slide | None:
-        """Return preloaded slide if it matches, else load synchronously."""
-        if self._preload_thread:
-            self._preload_thread.join(timeout=5)
-        if self._preloaded is not None:
-            return self._preloaded
-        if expected_idx < len(self.paths):
-            return self._load_slide(expected_idx)
-        return None
+    def _is_ahead(self, idx: int, center: int) -> bool:
+        """Whether idx is one of the PRELOAD_AHEAD slides following center."""
+        return 1 <= (idx - center) % len(self.paths) <= PRELOAD_AHEAD
+
+    def _request_preload(self, center: int):
+        """Queue the slides following center and evict all others."""
+        with self._slides_cond:
+            self._preload_center = center
+            for idx in list(self._slides):
+                if not self._is_ahead(idx, center):
+                    del self._slides[idx]
+        for step in range(1, PRELOAD_AHEAD + 1):
+            self._preload_q.put((center + step) % len(self.paths))
+
+    def _preload_worker(self):
+        while True:
+            idx = self._preload_q.get()
+            with self._slides_cond:
+                # Skip requests made stale by rapid navigation
+                if idx >= len(self.paths) or idx in self._slides:
+                    continue
+                if not self._is_ahead(idx, self._preload_center):
+                    continue
+                self._loading = idx
+            slide = self._load_slide(idx)
+            with self._slides_cond:
+                self._loading = None
+                if slide is not None:
+                    self._slides[idx] = slide
+                self._slides_cond.notify_all()
+
+    def _take_slide(self, idx: int) -> Slide | None:
+        """Return the preloaded slide for idx, waiting if the worker is on it."""
+        with self._slides_cond:
+            self._slides_cond.wait_for(lambda: self._loading != idx, timeout=5)
+            slide = self._slides.pop(idx, None)
+            # Claim idx: it is no longer ahead of the center, so a request for it
+            # still sitting in the queue is skipped instead of built a second time
+            self._preload_center = idx
+        return slide or self._load_slide(idx)
 
     def _begin_transition(self, target_index: int):
         """Start a crossfade to the slide at target_index."""
@@ -224,10 +463,7 @@ class Slideshow:
             return
 
         next_idx = target_index % len(self.paths)
-        if next_idx == self._next_index():
-            next_slide = self._get_preloaded(next_idx)
-        else:
-            next_slide = self._load_slide(next_idx)
+        next_slide = self._take_slide(next_idx)
 
         # If the slide failed to load, skip ahead to the next one
         if next_slide is None:
@@ -235,20 +471,21 @@ class Slideshow:
             return
 
         self.next_slide = next_slide
+        self._pending_idx = next_idx
         self.transitioning = True
         self.transition_start = time.time()
         self.alpha = 255
 
-        # Queue up next preload
-        self._preloaded = None
-        self._start_preload((next_idx + 1) % len(self.paths))
+        # Queue up the slides after the new one
+        self._request_preload(next_idx)
 
     def _finish_transition(self):
         self.current_slide = self.next_slide
         self.next_slide = None
         self.transitioning = False
         self.alpha = 255
-        self.index = self.paths.index(self.current_slide.path)  # type: ignore[union-attr]
+        self._dirty = True
+        self.index = self._pending_idx
         self.slide_start = time.time()
 
     def run(self):
@@ -266,6 +503,9 @@ class Slideshow:
             if event.type == pygame.QUIT:
                 self.running = False
 
+            elif event.type in (pygame.VIDEORESIZE, pygame.WINDOWEXPOSED):
+                self._dirty = True
+
             elif event.type == pygame.KEYDOWN:
                 key = event.key
 
@@ -301,6 +541,7 @@ class Slideshow:
         else:
             self.screen = pygame.display.set_mode((1280, 720), pygame.RESIZABLE)
             pygame.mouse.set_visible(True)
+        self._dirty = True
 
     def _update(self, dt: float):
         now = time.time()
@@ -317,47 +558,42 @@ class Slideshow:
         if self.transitioning:
             elapsed = now - self.transition_start
             progress = min(elapsed / self.config.transition_duration, 1.0)
-            # Ease in-out (sine)
-            eased = (1 - math.cos(progress * math.pi)) / 2
-            self.alpha = int(255 * (1 - eased))
+            self.alpha = self._alpha_table[int(progress * (len(self._alpha_table) - 1))]
 
             if progress >= 1.0:
                 self._finish_transition()
 
     def _draw(self):
-        sw, sh = self.screen.get_size()
-        self.screen.fill((0, 0, 0))
+        # Between transitions the screen already shows the current slide
+        if not (self._dirty or self.transitioning):
+            return
 
         if self.current_slide:
-            self._draw_slide(self.current_slide, self.alpha if self.transitioning else 255, sw, sh)
+            self._draw_slide(self.current_slide, None)
+        else:
+            self.screen.fill((0, 0, 0))
 
+        # Blending the next slide over the opaque current one yields
+        # current * alpha + next * (255 - alpha) in a single blit
         if self.transitioning and self.next_slide:
-            next_alpha = 255 - self.alpha
-            self._draw_slide(self.next_slide, next_alpha, sw, sh)
+            self._draw_slide(self.next_slide, 255 - self.alpha)
 
         pygame.display.flip()
+        self._dirty = False
 
-    def _draw_slide(self, slide: Slide, alpha: int, sw: int, sh: int):
-        """Blit background, foreground, and caption with given alpha."""
-        tmp = pygame.Surface((sw, sh), pygame.SRCALPHA)
-
-        # Background
-        bg = slide.background.copy()
-        bg_scaled = pygame.transform.scale(bg, (sw, sh)) if bg.get_size() != (sw, sh) else bg
-        tmp.blit(bg_scaled, (0, 0))
-
-        # Foreground (centered)
-        fg_rect = slide.foreground.get_rect(center=(sw // 2, sh // 2))
-        tmp.blit(slide.foreground, fg_rect)
+    def _draw_slide(self, slide: Slide, alpha: int | None):
+        """Blit the composed slide and its caption; alpha None draws them opaque."""
+        sw, sh = self.screen.get_size()
+        frame = slide.frame((sw, sh))
+        frame.set_alpha(alpha)
+        self.screen.blit(frame, (0, 0))
 
-        # Caption (only present when filename starts with '$')
+        # Caption (only present when filename starts with '$'). Unlike the opaque
+        # frame it must keep surface alpha enabled: set_alpha(None) would also
+        # disable its per-pixel alpha and draw the translucent bar solid.
         if slide.caption_surf is not None:
-            cap_y = sh - slide.caption_surf.get_height()
-            tmp.blit(slide.caption_surf, (0, cap_y))
-
-        # Apply alpha to entire surface
-        tmp.set_alpha(alpha)
-        self.screen.blit(tmp, (0, 0))
+            slide.caption_surf.set_alpha(255 if alpha is None else alpha)
+            self.screen.blit(slide.caption_surf, (0, sh - slide.caption_surf.get_height()))
 
 
 if __name__ == "__main__":